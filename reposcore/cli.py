@@ -17,6 +17,7 @@ import configparser
 import csv
 from functools import lru_cache, _make_key
 import git
+import multiprocessing
 import os
 import shutil
 import sys
@@ -26,7 +27,12 @@ import urllib
 
 from reposcore.utils import git_utils
 from reposcore.utils import matrix
+from reposcore.utils import metrics as rs_metrics
+from reposcore.utils import shard as rs_shard
+from reposcore.repo import canonical as rs_canonical
 from reposcore.repo import repo as rs_repo
+from reposcore.repo import token as rs_token
+from reposcore.stat import result as rs_result
 from reposcore.stat import stat as rs_stat
 
 
@@ -41,6 +47,7 @@ class RepoScore(object):
     def __init__(self):
         self.parser = self._create_parser()
         self.args = self.parser.parse_args()
+        self._check_args()
         self.config = self._initConfig()
         self.retry = int(self.config.get('global', 'retry'))
         self.enable_local = self.args.enable_local
@@ -53,7 +60,7 @@ class RepoScore(object):
             help='path to config file')
         parser.add_argument(
             "--project-list",
-            type=open, required=True, help="File name of projects url list.")
+            type=open, help="File name of projects url list.")
         parser.add_argument(
             "--result-file",
             type=str, required=True, help="Result file name.")
@@ -69,8 +76,67 @@ class RepoScore(object):
             "--enable-local",
             action='store_true', default=False,
             help='with local repo offline analysis')
+        parser.add_argument(
+            "--result-format",
+            choices=rs_result.RESULT_FORMATS, default='csv',
+            help='Format of the result file.')
+        parser.add_argument(
+            "--top",
+            type=int, default=None,
+            help='Only write the top N projects into the result file.')
+        parser.add_argument(
+            "--shard",
+            type=str, default=None,
+            help='Only score the projects of shard i/N, e.g. 0/4.')
+        parser.add_argument(
+            "--workers",
+            type=int, default=None,
+            help='Score with N local worker processes, one per shard.')
+        parser.add_argument(
+            "--journal",
+            type=str, nargs='+', default=None,
+            help='SQLite file to record the results of this shard. A run '
+                 'with an existing journal resumes it: projects already '
+                 'done in it are skipped and their recorded results are '
+                 'reused. Each shard needs its own file on a local disk, '
+                 '--merge accepts several of them.')
+        parser.add_argument(
+            "--merge",
+            action='store_true', default=False,
+            help='Only merge the journals into the result file.')
+        parser.add_argument(
+            "--metrics-port",
+            type=int, default=None,
+            help='Serve progress metrics on http://127.0.0.1:PORT/metrics, '
+                 'with --workers, PORT covers the whole run and worker i '
+                 'uses PORT + 1 + i.')
+        parser.add_argument(
+            "--status-interval",
+            type=int, default=60,
+            help='Print a progress summary every N seconds, 0 to disable.')
         return parser
 
+    def _check_args(self):
+        if not self.args.merge and not self.args.project_list:
+            self.parser.error('--project-list is required')
+        if self.args.merge and not self.args.journal:
+            self.parser.error('--merge requires --journal')
+        if self.args.workers and self.args.shard:
+            self.parser.error('--workers can not be used with --shard')
+        if (not self.args.merge and self.args.journal and
+                len(self.args.journal) > 1):
+            self.parser.error('--journal takes several files only with '
+                              '--merge')
+        # Only resume from the journals the user asked for
+        self.resume = bool(self.args.journal)
+        if self.args.workers and not self.args.journal:
+            self.args.journal = [self.args.result_file + '.journal']
+        if self.args.shard:
+            try:
+                rs_shard.parse_shard(self.args.shard)
+            except Exception as exp:
+                self.parser.error(str(exp))
+
     def _initConfig(self):
         config = configparser.ConfigParser()
         if self.args.config:
@@ -136,20 +202,52 @@ class RepoScore(object):
         else:
             return arr
 
-    def run(self):
-        repo_urls = set()
-        repo_urls.update(self.args.project_list.read().splitlines())
+    def _start_metrics(self, queued, port_offset=0, report=True):
+        rs_metrics.METRICS.start(queued)
+        if self.args.metrics_port is not None:
+            rs_metrics.METRICS.serve(self.args.metrics_port + port_offset)
+        if report and self.args.status_interval:
+            rs_metrics.METRICS.report(self.args.status_interval)
+
+    def _journal_paths(self):
+        """Return the journal files written by this run."""
+        if not self.args.journal:
+            return []
+        if self.args.workers and not self.args.merge:
+            # One journal per worker, SQLite files can not be shared
+            count = self.args.workers
+            return ['%s.%d-of-%d' % (self.args.journal[0], index, count)
+                    for index in range(count)]
+        return self.args.journal
+
+    def _score(self, repo_urls, t, shard='', journal_path=None):
+        journal = None
+        if journal_path:
+            journal = rs_shard.Journal(journal_path)
 
         csv_writer = csv.writer(sys.stdout)
-        header = None
-        stats = []
-        if self.args.auto_update:
-            self._auto_update_repo(repo_urls)
-        t = time.strftime("%Y-%m-%dT%H:00:00+0800")
+        table = None
         for repo_url in repo_urls:
             if not repo_url:
                 continue
+            if journal:
+                # Share the counters of this worker with the parent
+                journal.save_metrics(rs_metrics.METRICS.snapshot())
+                done = journal.is_done(repo_url)
+                rs_metrics.METRICS.cache_hit('journal', done)
+                if done:
+                    print('Skip %s, already done in %s' % (
+                        repo_url, journal_path))
+                    # New input urls of the repo still need their rows
+                    for row in journal.add_missing_aliases(
+                            repo_url, repo_urls[repo_url]):
+                        print('Add %s from the result of %s' % (
+                            row['input_url'], repo_url))
+                    rs_metrics.METRICS.repo_skipped()
+                    continue
+            rs_metrics.METRICS.repo_started()
             output = None
+            detail = ''
             for _ in range(self.retry):
                 try:
                     repo = rs_repo.get_repository(
@@ -158,25 +256,166 @@ class RepoScore(object):
                     output = stat.get_stats()
                     break
                 except Exception as exp:
+                    detail = str(exp)
                     print('Failed reading repo %s\n. Detail: %s' % (
                         repo_url, exp))
+            rs_metrics.METRICS.repo_finished(bool(output))
             if not output:
+                if journal:
+                    journal.add_failure(repo_url, detail, shard)
                 continue
-            if not header:
-                header = self._insert_val(output.keys(), 'created_at')
-                csv_writer.writerow(header)
-            csv_writer.writerow(
-                self._insert_val(output.values(), t))
-            stats.append(output)
-
-        with open(self.args.result_file, 'w') as file_handle:
-            csv_writer = csv.writer(file_handle)
-            csv_writer.writerow(header)
-            for i in sorted(stats,
-                            key=lambda i: i['criticality_score'],
-                            reverse=True):
+            rows = []
+            for alias in repo_urls[repo_url]:
+                row = dict(output, input_url=alias)
+                if table is None:
+                    table = rs_result.ResultTable(row.keys())
+                    csv_writer.writerow(
+                        self._insert_val(table.columns, 'created_at'))
+                table.append(row)
                 csv_writer.writerow(
-                    self._insert_val(i.values(), t))
+                    self._insert_val(table.row(len(table) - 1), t))
+                rows.append(row)
+            if journal:
+                journal.add_result(repo_url, rows, shard)
+
+        if journal:
+            journal.save_metrics(rs_metrics.METRICS.snapshot())
+            journal.close()
+        label = 'reposcore %s' % shard if shard else 'reposcore'
+        print('[%s] %s' % (label, rs_metrics.METRICS.summary()),
+              file=sys.stderr)
+        return table
+
+    def _shard_lines(self, lines, index, count):
+        """Return the input urls of shard index/count.
+
+        The routing uses the local canonical url, which is the same on
+        every node, renames are only resolved inside the shard.
+        """
+        shard_lines = []
+        for line in lines:
+            canonical_url = rs_canonical.canonicalize_url(line)
+            if (canonical_url and
+                    rs_shard.shard_of(canonical_url, count) == index):
+                shard_lines.append(line)
+        return shard_lines
+
+    def _run_shard(self, lines, t, shard, journal_path, port_offset=0):
+        # The cached GitHub client of the parent keeps a persistent HTTPS
+        # connection, the forked workers must not share it.
+        rs_token._CACHED_GITHUB_TOKEN = None
+        rs_token._CACHED_GITHUB_TOKEN_OBJ = None
+        # Only count this shard, the parent reports the whole run
+        rs_metrics.METRICS.reset()
+        repo_urls = rs_canonical.URLResolver(self.config).group(lines)
+        # Only the parent prints the periodic summary of the whole run
+        self._start_metrics(len(repo_urls), port_offset, report=False)
+        if self.args.auto_update:
+            self._auto_update_repo(repo_urls)
+        self._score(repo_urls, t, shard, journal_path)
+
+    def _run_workers(self, lines, t):
+        # Fork, so the workers share the parsed args and config
+        ctx = multiprocessing.get_context('fork')
+        count = self.args.workers
+        journal_paths = self._journal_paths()
+        if not self.resume:
+            # The default journals only hold the results of this run
+            for path in journal_paths:
+                for name in (path, path + '-journal'):
+                    if os.path.exists(name):
+                        os.remove(name)
+        workers = []
+        for index in range(count):
+            shard = '%d/%d' % (index, count)
+            worker = ctx.Process(
+                target=self._run_shard,
+                args=(self._shard_lines(lines, index, count), t, shard,
+                      journal_paths[index], index + 1))
+            worker.start()
+            workers.append((shard, worker))
+
+        # Start serving after the fork, the workers must not inherit it
+        start_time = time.time()
+        # Renames are resolved by the workers, count the local urls
+        total = len(set(filter(None, map(rs_canonical.canonicalize_url,
+                                         lines))))
+
+        def _collect(metrics):
+            done, failed, done_before = 0, 0, 0
+            snapshots = []
+            for path in journal_paths:
+                journal = rs_shard.Journal(path)
+                counts = journal.counts(start_time)
+                snapshots.extend(journal.load_metrics())
+                journal.close()
+                done += counts[0]
+                failed += counts[1]
+                done_before += counts[2]
+            in_flight = sum(1 for (_, w) in workers if w.is_alive())
+            queued = total - done_before - done - failed - in_flight
+            metrics.set_progress(done, failed, in_flight, max(queued, 0))
+            metrics.set_snapshots(snapshots)
+
+        rs_metrics.METRICS.collector = _collect
+        self._start_metrics(total)
+        for shard, worker in workers:
+            worker.join()
+            if worker.exitcode:
+                print('Worker of shard %s failed, exit code: %d' % (
+                    shard, worker.exitcode))
+        print('[reposcore] %s' % rs_metrics.METRICS.summary(),
+              file=sys.stderr)
+
+    def _load_journals(self, paths):
+        table = None
+        for path in paths:
+            journal = rs_shard.Journal(path)
+            for row in journal.rows():
+                if table is None:
+                    table = rs_result.ResultTable(row.keys())
+                table.append(row)
+            journal.close()
+        return table
+
+    def run(self):
+        t = time.strftime("%Y-%m-%dT%H:00:00+0800")
+        table = None
+        if not self.args.merge:
+            lines = self.args.project_list.read().splitlines()
+            shard = ''
+            if self.args.shard:
+                index, count = rs_shard.parse_shard(self.args.shard)
+                lines = self._shard_lines(lines, index, count)
+                shard = self.args.shard
+
+            if self.args.workers:
+                self._run_workers(lines, t)
+            else:
+                # canonical url -> input urls, each repo is scored once
+                repo_urls = rs_canonical.URLResolver(self.config).group(
+                    lines)
+                self._start_metrics(len(repo_urls))
+                if self.args.auto_update:
+                    self._auto_update_repo(repo_urls)
+                journal_paths = self._journal_paths()
+                table = self._score(
+                    repo_urls, t, shard,
+                    journal_paths[0] if journal_paths else None)
+
+        # With journals, the result file holds everything recorded in them
+        if self.args.journal:
+            table = self._load_journals(self._journal_paths())
+
+        if table is None:
+            table = rs_result.ResultTable([])
+        extra = [('created_at', t)] if self.args.with_time else []
+        table.export(
+            self.args.result_file, self.args.result_format,
+            # --top counts repos, with all the input urls of each repo
+            indices=table.order_by(
+                'criticality_score', limit=self.args.top, distinct='url'),
+            extra=extra)
         print('Finished, the results file is: %s' % self.args.result_file)
 
 
@@ -205,7 +444,7 @@ class SingleRepoScore(RepoScore):
             repo_url, self.config, self.args.enable_local)
         stat = rs_stat.Stat(self.config, repo)
         output = stat.get_stats()
-        return output
+        return rs_result.format_stats(output)
 
 
 def main():
@@ -0,0 +1,202 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Canonicalize and deduplicate input project urls."""
+
+from collections import OrderedDict
+import json
+import os
+import urllib.parse
+
+import requests
+
+from reposcore.repo import token
+from reposcore.utils import metrics
+
+
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+# Number of repositories resolved in one GraphQL request
+BATCH_SIZE = 50
+
+
+# The ports which are dropped
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    """Return the canonical form of a project url, without any request.
+
+    e.g. 'github.com/X/Y', 'https://github.com/x/y/' and
+    'git@github.com:x/y.git' are all 'https://github.com/x/y'. The scheme
+    and the port of other hosts are kept, as self-hosted GitLab servers
+    may only be reached with them.
+    """
+    url = url.strip()
+    if not url:
+        return None
+    if url.startswith('git@') and '://' not in url:
+        url = 'ssh://' + url.replace(':', '/', 1)
+    if '://' not in url:
+        url = 'https://' + url
+
+    parsed_url = urllib.parse.urlparse(url)
+    scheme = parsed_url.scheme.lower()
+    host = (parsed_url.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    try:
+        port = parsed_url.port
+    except ValueError:
+        port = None
+    path = parsed_url.path.strip('/')
+    if host.endswith('github.com'):
+        # GitHub names are case insensitive, and only owner/repo matters,
+        # e.g. drop '/tree/master' of a browser url.
+        path = '/'.join(path.lower().split('/')[:2])
+        scheme, port = 'https', None
+    else:
+        # GitLab allows nested groups, only drop the '/-/...' pages.
+        path = path.split('/-/')[0]
+    if port == _DEFAULT_PORTS.get(scheme):
+        port = None
+    if scheme not in ('http', 'https'):
+        # e.g. ssh, the api of the host is served on https, and the ssh
+        # port tells nothing about it
+        scheme, port = 'https', None
+    if port is not None:
+        host = '%s:%d' % (host, port)
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    return '%s://%s/%s' % (scheme, host, path)
+
+
+class URLResolver():
+    """Map input urls to the repository they are scored as.
+
+    Urls are canonicalized locally first, then renamed (and optionally
+    forked) GitHub repositories are resolved with batched GraphQL
+    lookups. The mapping is cached in a json file across runs.
+    """
+
+    def __init__(self, config):
+        self.resolve_renames = config.getboolean(
+            'canonical', 'resolve_renames', fallback=True)
+        self.merge_forks = config.getboolean(
+            'canonical', 'merge_forks', fallback=False)
+        self.cache_file = os.path.expanduser(config.get(
+            'canonical', 'cache_file',
+            fallback='~/.cache/reposcore/canonical.json'))
+        self.cache = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_file) as file_handle:
+                return json.load(file_handle)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self):
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        # Workers may save the cache at the same time
+        tmp_file = '%s.%d.tmp' % (self.cache_file, os.getpid())
+        with open(tmp_file, 'w') as file_handle:
+            json.dump(self.cache, file_handle, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.cache_file)
+
+    def _lookup_github(self, full_names):
+        """Resolve owner/repo names with one GraphQL request.
+
+        Return a dict of name -> {'name': ..., 'parent': ...}, the names
+        which are not found are left out.
+        """
+        queries = []
+        for i, full_name in enumerate(full_names):
+            owner, name = full_name.split('/')
+            queries.append(
+                'r%d: repository(owner: %s, name: %s) '
+                '{ nameWithOwner parent { nameWithOwner } }' % (
+                    i, json.dumps(owner), json.dumps(name)))
+        token.get_github_auth_token()
+        headers = {'Authorization': f'token {token._CACHED_GITHUB_TOKEN}'}
+        result = requests.post(
+            GITHUB_GRAPHQL_URL, headers=headers,
+            json={'query': 'query { %s }' % ' '.join(queries)})
+        if result.status_code != 200:
+            raise Exception('GraphQL lookup failed with status %d' % (
+                result.status_code))
+
+        data = result.json().get('data') or {}
+        resolved = {}
+        for i, full_name in enumerate(full_names):
+            repo = data.get('r%d' % i)
+            if not repo:
+                continue
+            parent = repo.get('parent') or {}
+            resolved[full_name] = {
+                'name': repo['nameWithOwner'].lower(),
+                'parent': (parent.get('nameWithOwner') or '').lower(),
+            }
+        return resolved
+
+    def _resolve_github(self, urls):
+        prefix = 'https://github.com/'
+        pending = []
+        for url in urls:
+            if (not url.startswith(prefix) or
+                    url[len(prefix):].count('/') != 1):
+                continue
+            metrics.METRICS.cache_hit('canonical', url in self.cache)
+            if url not in self.cache:
+                pending.append(url[len(prefix):])
+        if not pending:
+            return
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = pending[start:start + BATCH_SIZE]
+            try:
+                resolved = self._lookup_github(batch)
+            except Exception as exp:
+                print('Failed resolving repo urls, use them as is. '
+                      'Detail: %s' % exp)
+                break
+            for full_name in batch:
+                if full_name in resolved:
+                    self.cache[prefix + full_name] = resolved[full_name]
+        self._save_cache()
+
+    def _resolved_url(self, url):
+        info = self.cache.get(url)
+        if not info:
+            return url
+        if self.merge_forks and info['parent']:
+            return 'https://github.com/' + info['parent']
+        return 'https://github.com/' + info['name']
+
+    def group(self, urls):
+        """Return an ordered dict of canonical url -> input urls."""
+        canonical = OrderedDict()
+        for url in urls:
+            canonical_url = canonicalize_url(url)
+            if not canonical_url:
+                continue
+            aliases = canonical.setdefault(canonical_url, [])
+            if url not in aliases:
+                aliases.append(url)
+
+        if self.resolve_renames:
+            self._resolve_github(canonical.keys())
+
+        groups = OrderedDict()
+        for canonical_url, aliases in canonical.items():
+            groups.setdefault(
+                self._resolved_url(canonical_url), []).extend(aliases)
+        return groups
@@ -11,6 +11,7 @@
 # limitations under the License.
 from collections import defaultdict
 import datetime
+import fnmatch
 from functools import lru_cache, _make_key
 import json
 import re
@@ -23,6 +24,7 @@ from git import Repo
 import requests
 
 from reposcore.repo import token
+from reposcore.utils import git_utils
 from reposcore.utils import matrix
 
 
@@ -40,6 +42,9 @@ class GitLocalRepo():
         except Exception:
             raise Exception("No local git repo find: %s" % self.local_path)
         self.since_time = self._get_start_date()
+        # Merge the commits of an author by 'email' or by 'name', both of
+        # them are mapped with the .mailmap of the repo first.
+        self.identity = config.get('global', 'identity', fallback='email')
 
     def threadsafe_lru(func):
         # Enable the LRU cache, that means *same func with same args*
@@ -58,63 +63,82 @@ class GitLocalRepo():
         month_day = time.strftime('%m-%d', time.localtime(time.time()))
         return '{}-{}'.format(start_year, month_day)
 
-    def _count_code_line(self, repo, match):
-        addition = 0
-        deletion = 0
-
-        changes = repo.git.log(
-            '--since', self.since_time, '--shortstat', '--oneline',
-            '--', match
-            ).split('\n')
-        for change in changes:
-            if ('files changed' not in change and
-                    'file changed' not in change):
-                continue
-            if 'insertions' in change:
-                addition += int(
-                    change.split(' insertions')[0].split(', ')[-1])
-            if 'deletions' in change:
-                deletion += int(
-                    change.split(' deletions')[0].split(', ')[-1])
-        return addition, deletion
-
     @threadsafe_lru
+    def _log_summary(self, path, matches):
+        """Walk the log of recent year once, and sum up all local stats.
+
+        Return a dict with the line changes of every file pattern in
+        matches, the commit count of every author identity and the count
+        of non-merge commits.
+        """
+        if path == self.local_path:
+            repo = self.local_repo
+        else:
+            repo = Repo(path)
+
+        changes = {match: [0, 0] for match in matches}
+        authors = defaultdict(int)
+        commits = 0
+        for commit in git_utils.iter_commits(
+                repo, '--since', self.since_time):
+            if self.identity == 'email' and commit.author_email:
+                authors[commit.author_email.lower()] += 1
+            else:
+                authors[commit.author_name] += 1
+            if len(commit.parents) < 2:
+                commits += 1
+            for (file_path, add, dele) in commit.files:
+                if add is None:
+                    continue
+                for match in matches:
+                    # Same as the glob of a git pathspec, '*' matches '/'
+                    if fnmatch.fnmatchcase(file_path, match):
+                        changes[match][0] += add
+                        changes[match][1] += dele
+
+        return {'changes': changes, 'authors': authors, 'commits': commits}
+
+    def _matches(self):
+        return ('*',) + tuple(
+            '*.' + match for match in
+            matrix.LANGUAGE_MAPPING.get(self.main_language, ['*']))
+
+    def _log_summaries(self):
+        if matrix.SUBMODULE_MAPPING.get(self.local_name):
+            return [self._log_summary(
+                        self.local_path + '/' + m_name, self._matches())
+                    for m_name in matrix.SUBMODULE_MAPPING[self.local_name]]
+        return [self._log_summary(self.local_path, self._matches())]
+
     def _code_line_change_recent_year(self, match="*"):
         addition = 0
         deletion = 0
-
-        if matrix.SUBMODULE_MAPPING.get(self.local_name):
-            for m_name in matrix.SUBMODULE_MAPPING[self.local_name]:
-                module_repo = Repo(self.local_path + '/' + m_name)
-                child_addition, child_deletion = self._count_code_line(
-                    module_repo, match)
-                addition += child_addition
-                deletion += child_deletion
-        else:
-            addition, deletion = self._count_code_line(self.local_repo, match)
-
+        for summary in self._log_summaries():
+            addition += summary['changes'][match][0]
+            deletion += summary['changes'][match][1]
         return (addition, deletion)
 
+    # NOTE: The local stats below return raw numbers, the human readable
+    # strings are only built on output, see reposcore.stat.result.
     @property
     def code_effort(self):
         # if you write 20 loc everyday, 20*22*12=5280 line
         add = self._code_line_change_recent_year()[0]
-        return '%.1f' % float(add / 5280)
+        return round(add / 5280, 1)
 
     @property
     def code_line_change_recent_year(self):
-        return "+%d, -%d" % self._code_line_change_recent_year()
+        return self._code_line_change_recent_year()
 
     @property
     def core_effort(self):
         # if you write 20 loc everyday, 20*22*12=5280 line
         add = self._core_line_change_recent_year()[0]
-        return '%.1f' % float(add / 5280)
+        return round(add / 5280, 1)
 
     @property
     def core_line_change_recent_year(self):
-        add, dele, detail = self._core_line_change_recent_year()
-        return "+%d, -%d (%s)" % (add, dele, detail)
+        return self._core_line_change_recent_year()
 
     def _core_line_change_recent_year(self):
         change = {}
@@ -126,32 +150,20 @@ class GitLocalRepo():
         for (k, v) in change.items():
             # code have some change
             if v[0] or v[1]:
-                res.append("%s: +%d, -%d" % (k, v[0], v[1]))
+                res.append((k, v[0], v[1]))
                 addition += v[0]
                 deletion += v[1]
 
-        return (addition, deletion, ' '.join(res))
+        return (addition, deletion, tuple(res))
 
     @property
     def activity_contributor_count_recent_year(self):
         author_dict = defaultdict(int)
         active_count = 0
 
-        def _gen_author_dict(repo):
-            nonlocal author_dict
-            out_format = '--pretty=format:%an'
-            authors = repo.git.log(
-                '--since', self.since_time, out_format
-                ).replace('\\', '').split('\n')
-            for author_raw in authors:
-                author_dict[author_raw] += 1
-
-        if matrix.SUBMODULE_MAPPING.get(self.local_name):
-            for m_name in matrix.SUBMODULE_MAPPING[self.local_name]:
-                module_repo = Repo(self.local_path + '/' + m_name)
-                _gen_author_dict(module_repo)
-        else:
-            _gen_author_dict(self.local_repo)
+        for summary in self._log_summaries():
+            for (author, count) in summary['authors'].items():
+                author_dict[author] += count
 
         for value in author_dict.values():
             if value >= 20:
@@ -161,11 +173,8 @@ class GitLocalRepo():
 
     @property
     def commit_frequency_local(self):
-        out_format = '--pretty=format:%h'
-        commits = self.local_repo.git.log(
-                '--no-merges', '--since', self.since_time, out_format
-        ).replace('\\', '').split('\n')
-        return round(len(commits) / 52, 1)
+        summary = self._log_summary(self.local_path, self._matches())
+        return round(summary['commits'] / 52, 1)
 
 
 # TODO: Remove all cs_run related code in future
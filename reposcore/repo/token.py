@@ -17,15 +17,19 @@ import time
 import github
 import gitlab
 
+from reposcore.utils import metrics
+
 
 _CACHED_GITHUB_TOKEN = None
 _CACHED_GITHUB_TOKEN_OBJ = None
 
 
 # TODO(yikun): Move token related code into separated class
-def get_github_token_info(token_obj):
+def get_github_token_info(token_obj, token=None):
     """Return expiry information given a github token."""
     rate_limit = token_obj.get_rate_limit()
+    if token:
+        metrics.METRICS.set_token_remaining(token, rate_limit.core.remaining)
     near_expiry = rate_limit.core.remaining < 50
     wait_time = (rate_limit.core.reset - datetime.datetime.utcnow()).seconds
     return near_expiry, wait_time
@@ -37,7 +41,8 @@ def get_github_auth_token():
     global _CACHED_GITHUB_TOKEN
     global _CACHED_GITHUB_TOKEN_OBJ
     if _CACHED_GITHUB_TOKEN_OBJ:
-        near_expiry, _ = get_github_token_info(_CACHED_GITHUB_TOKEN_OBJ)
+        near_expiry, _ = get_github_token_info(
+            _CACHED_GITHUB_TOKEN_OBJ, _CACHED_GITHUB_TOKEN)
         if not near_expiry:
             return _CACHED_GITHUB_TOKEN_OBJ
 
@@ -51,7 +56,7 @@ def get_github_auth_token():
     token_obj = None
     for token in tokens:
         token_obj = github.Github(token)
-        near_expiry, wait_time = get_github_token_info(token_obj)
+        near_expiry, wait_time = get_github_token_info(token_obj, token)
         if not min_wait_time or wait_time < min_wait_time:
             min_wait_time = wait_time
         if not near_expiry:
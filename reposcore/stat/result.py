@@ -0,0 +1,254 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Columnar in-memory storage for batch results."""
+
+from array import array
+import csv
+import heapq
+import json
+
+
+STRING = 'string'
+CATEGORY = 'category'
+INT = 'int'
+FLOAT = 'float'
+# (addition, deletion)
+CHANGE = 'change'
+# (addition, deletion, ((ext, addition, deletion), ...))
+CORE_CHANGE = 'core_change'
+
+COLUMN_TYPES = {
+    'name': STRING,
+    'url': STRING,
+    'language': CATEGORY,
+    'created_since': INT,
+    'updated_since': INT,
+    'contributor_count': INT,
+    'org_count': INT,
+    'commit_frequency': FLOAT,
+    'recent_releases_count': INT,
+    'updated_issues_count': INT,
+    'closed_issues_count': INT,
+    'comment_frequency': FLOAT,
+    'dependents_count': INT,
+    'code_line_change_recent_year': CHANGE,
+    'code_effort': FLOAT,
+    'core_line_change_recent_year': CORE_CHANGE,
+    'core_effort': FLOAT,
+    'activity_contributor_count_recent_year': INT,
+    'criticality_score': FLOAT,
+}
+
+RESULT_FORMATS = ('csv', 'json', 'parquet')
+
+
+def _format_change(value):
+    return "+%d, -%d" % (value[0], value[1])
+
+
+def _format_core_change(value):
+    detail = ' '.join(
+        "%s: +%d, -%d" % (ext, add, dele) for (ext, add, dele) in value[2])
+    return "+%d, -%d (%s)" % (value[0], value[1], detail)
+
+
+# Columns which are not written as their raw value
+FORMATTERS = {
+    'code_line_change_recent_year': _format_change,
+    'code_effort': lambda v: '%.1f' % v,
+    'core_line_change_recent_year': _format_core_change,
+    'core_effort': lambda v: '%.1f' % v,
+}
+
+
+def format_value(column, value):
+    """Return the output representation of a raw column value."""
+    formatter = FORMATTERS.get(column)
+    if formatter:
+        return formatter(value)
+    return value
+
+
+def format_stats(stats):
+    """Return a copy of a raw stats dict with output values."""
+    return {k: format_value(k, v) for (k, v) in stats.items()}
+
+
+class ResultTable():
+    """Hold batch results column by column.
+
+    Numeric columns are kept in typed arrays, repeated strings (like
+    language) are stored once with an integer code per row, and the
+    formatted strings are only built when rows are written out.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self._size = 0
+        self._data = {}
+        self._categories = {}
+        for column in self.columns:
+            col_type = COLUMN_TYPES.get(column, STRING)
+            if col_type == CATEGORY:
+                self._data[column] = array('l')
+                self._categories[column] = ([], {})
+            elif col_type == INT:
+                self._data[column] = array('q')
+            elif col_type == FLOAT:
+                self._data[column] = array('d')
+            elif col_type == CHANGE:
+                self._data[column] = (array('q'), array('q'))
+            elif col_type == CORE_CHANGE:
+                self._data[column] = (array('q'), array('q'), [])
+            else:
+                self._data[column] = []
+
+    def __len__(self):
+        return self._size
+
+    def append(self, row):
+        """Append a raw stats dict as a new row."""
+        for column in self.columns:
+            value = row.get(column)
+            col_type = COLUMN_TYPES.get(column, STRING)
+            data = self._data[column]
+            if col_type == CATEGORY:
+                values, codes = self._categories[column]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(values)
+                    values.append(value)
+                data.append(code)
+            elif col_type == INT:
+                data.append(int(value or 0))
+            elif col_type == FLOAT:
+                data.append(float(value or 0))
+            elif col_type in (CHANGE, CORE_CHANGE):
+                # Rows loaded back from json hold lists
+                if not isinstance(value, (tuple, list)):
+                    # The stat is missing, e.g. the local repo failed
+                    value = (0, 0, ())
+                data[0].append(value[0])
+                data[1].append(value[1])
+                if col_type == CORE_CHANGE:
+                    data[2].append(value[2])
+            else:
+                data.append(value)
+        self._size += 1
+
+    def value(self, column, index):
+        """Return the raw value of a cell."""
+        col_type = COLUMN_TYPES.get(column, STRING)
+        data = self._data[column]
+        if col_type == CATEGORY:
+            return self._categories[column][0][data[index]]
+        if col_type == CHANGE:
+            return (data[0][index], data[1][index])
+        if col_type == CORE_CHANGE:
+            return (data[0][index], data[1][index], data[2][index])
+        return data[index]
+
+    def row(self, index, formatted=True):
+        """Return the values of a row, in column order."""
+        if formatted:
+            return [format_value(c, self.value(c, index))
+                    for c in self.columns]
+        return [self.value(c, index) for c in self.columns]
+
+    def order_by(self, column='criticality_score', reverse=True, limit=None,
+                 distinct=None):
+        """Return row indices sorted on a numeric column.
+
+        If limit is given only the top `limit` indices are returned, which
+        avoids sorting the whole table. With a `distinct` column, limit
+        counts the distinct values of that column instead of rows, and
+        all the rows of the selected values are returned.
+        """
+        if not self._size:
+            return []
+        key = self._data[column].__getitem__
+        if limit is None or limit >= self._size:
+            return sorted(range(self._size), key=key, reverse=reverse)
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        if distinct is None:
+            return select(limit, range(self._size), key=key)
+
+        # One row of each value is enough to pick the top values
+        first_rows = {}
+        for i in range(self._size):
+            first_rows.setdefault(self.value(distinct, i), i)
+        selected = set(self.value(distinct, i) for i in select(
+            limit, first_rows.values(), key=key))
+        return sorted(
+            (i for i in range(self._size)
+             if self.value(distinct, i) in selected),
+            key=key, reverse=reverse)
+
+    def _json_value(self, column, index):
+        # Composite values are written formatted, scalars keep their type
+        value = self.value(column, index)
+        if COLUMN_TYPES.get(column) in (CHANGE, CORE_CHANGE):
+            return format_value(column, value)
+        return value
+
+    def to_csv(self, path, indices=None, extra=()):
+        """Write rows into a csv file.
+
+        `extra` is a list of (column, value) pairs inserted in front of
+        every row, e.g. the time of the run.
+        """
+        if indices is None:
+            indices = range(self._size)
+        extra_values = [v for (_, v) in extra]
+        with open(path, 'w') as file_handle:
+            csv_writer = csv.writer(file_handle)
+            if self.columns:
+                csv_writer.writerow([c for (c, _) in extra] + self.columns)
+            for i in indices:
+                csv_writer.writerow(extra_values + self.row(i))
+
+    def to_json(self, path, indices=None, extra=()):
+        """Write rows into a json file, as a list of objects."""
+        if indices is None:
+            indices = range(self._size)
+        with open(path, 'w') as file_handle:
+            file_handle.write('[')
+            for n, i in enumerate(indices):
+                item = dict(extra)
+                for column in self.columns:
+                    item[column] = self._json_value(column, i)
+                file_handle.write((',\n' if n else '\n') + json.dumps(item))
+            file_handle.write('\n]\n')
+
+    def to_parquet(self, path, indices=None, extra=()):
+        """Write rows into a parquet file, requires pyarrow."""
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("pyarrow needs to be installed for parquet "
+                            "output.")
+        if indices is None:
+            indices = range(self._size)
+        indices = list(indices)
+        arrays = {}
+        for (column, value) in extra:
+            arrays[column] = [value] * len(indices)
+        for column in self.columns:
+            arrays[column] = [self._json_value(column, i) for i in indices]
+        pyarrow.parquet.write_table(pyarrow.table(arrays), path)
+
+    def export(self, path, result_format='csv', indices=None, extra=()):
+        """Write rows into path with the given result format."""
+        if result_format not in RESULT_FORMATS:
+            raise Exception("Unsupported result format: %s" % result_format)
+        getattr(self, 'to_' + result_format)(path, indices, extra)
@@ -1,10 +1,97 @@
+from collections import namedtuple
+import re
+
 import git
 
+from reposcore.utils import metrics
+
+
+# NOTE: 0x1e separates the commits and 0x1f the header fields, neither
+# can be typed in a name or an email.
+_LOG_FORMAT = '--format=%x1e%H%x1f%P%x1f%aN%x1f%aE%x1f%at'
+_READ_SIZE = 1 << 16
+
+_RECEIVED_RE = re.compile(r'([0-9.]+) (bytes|KiB|MiB|GiB)')
+_UNITS = {'bytes': 1, 'KiB': 1 << 10, 'MiB': 1 << 20, 'GiB': 1 << 30}
+
+# files is a tuple of (path, additions, deletions), the line counts of
+# binary files are None.
+Commit = namedtuple(
+    'Commit',
+    ['sha', 'parents', 'author_name', 'author_email', 'timestamp', 'files'])
+
 
 class Progress(git.remote.RemoteProgress):
     def __init__(self, name):
         super(Progress, self).__init__()
         self.name = name
+        self.received = 0
+
+    def _count_received(self, op_code, message):
+        # The message of receiving objects is like ', 1.50 MiB | 2 MiB/s'
+        if not op_code & self.RECEIVING:
+            return
+        match = _RECEIVED_RE.search(message or '')
+        if not match:
+            return
+        received = int(float(match.group(1)) * _UNITS[match.group(2)])
+        if received > self.received:
+            metrics.METRICS.add_clone_bytes(received - self.received)
+            self.received = received
 
     def update(self, op_code, cur_count, max_count=None, message=''):
+        self._count_received(op_code, message)
         print('Cloning %s, %s' % (self.name, self._cur_line))
+
+
+def _parse_numstat(raw):
+    files = []
+    tokens = raw.lstrip('\n').split('\0')
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if not token:
+            continue
+        add, dele, path = token.split('\t', 2)
+        if not path:
+            # A rename, followed by the old and the new path
+            path = tokens[i + 1]
+            i += 2
+        if add == '-':
+            files.append((path, None, None))
+        else:
+            files.append((path, int(add), int(dele)))
+    return tuple(files)
+
+
+def _parse_commit(record):
+    header, _, raw = record.partition('\0')
+    sha, parents, name, email, timestamp = header.split('\x1f')
+    return Commit(sha, tuple(parents.split()), name, email,
+                  int(timestamp), _parse_numstat(raw))
+
+
+def iter_commits(repo, *args):
+    """Yield the commits of `git log <args>` as Commit records.
+
+    The log is read with -z and --numstat, so the result does not depend
+    on the locale of git. Authors are mapped with the .mailmap of the
+    repo. The output is streamed, so it is fine for huge histories.
+    """
+    proc = repo.git.log(
+        '-z', '--numstat', _LOG_FORMAT, *args, as_process=True)
+    buf = b''
+    while True:
+        chunk = proc.stdout.read(_READ_SIZE)
+        if not chunk:
+            break
+        records = (buf + chunk).split(b'\x1e')
+        # The last record may be incomplete
+        buf = records.pop()
+        for record in records:
+            if record:
+                yield _parse_commit(record.decode('utf-8', 'replace'))
+    if buf:
+        yield _parse_commit(buf.decode('utf-8', 'replace'))
+    proc.wait()
@@ -0,0 +1,264 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Live progress metrics of a batch run."""
+
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import sys
+import threading
+import time
+
+
+class Metrics():
+    """Thread safe counters of a batch run.
+
+    They are exposed in Prometheus text format by serve(), and printed as
+    a one line summary by report().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Called with the metrics before they are read, to refresh them
+        # from somewhere else, e.g. the journals of the workers.
+        self.collector = None
+        self._clear()
+
+    def _clear(self):
+        self.start_time = time.time()
+        self.done = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.clone_bytes = 0
+        self.cache_hits = defaultdict(int)
+        self.cache_misses = defaultdict(int)
+        self.token_remaining = {}
+
+    def reset(self):
+        """Clear all the counters, e.g. the copy of a forked worker."""
+        with self.lock:
+            self._clear()
+
+    def start(self, queued):
+        """Start measuring a run of `queued` repos."""
+        with self.lock:
+            self.start_time = time.time()
+            self.queued = queued
+
+    def repo_started(self):
+        with self.lock:
+            self.queued = max(self.queued - 1, 0)
+            self.in_flight += 1
+
+    def repo_finished(self, ok):
+        with self.lock:
+            self.in_flight -= 1
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def set_progress(self, done, failed, in_flight, queued):
+        with self.lock:
+            self.done = done
+            self.failed = failed
+            self.in_flight = in_flight
+            self.queued = queued
+
+    def repo_skipped(self):
+        with self.lock:
+            self.queued = max(self.queued - 1, 0)
+
+    def cache_hit(self, cache, hit=True):
+        with self.lock:
+            if hit:
+                self.cache_hits[cache] += 1
+            else:
+                self.cache_misses[cache] += 1
+
+    def add_clone_bytes(self, count):
+        with self.lock:
+            self.clone_bytes += count
+
+    def set_token_remaining(self, token, remaining):
+        # Only keep the tail of the token, it is shown in the metrics
+        with self.lock:
+            self.token_remaining['...' + token[-4:]] = remaining
+
+    def snapshot(self):
+        """Return the counters gathered from the workers by the parent.
+
+        They are returned as a list of (name, label, value).
+        """
+        with self.lock:
+            rows = [('clone_bytes', '', self.clone_bytes)]
+            rows.extend(('cache_hits', k, v)
+                        for (k, v) in self.cache_hits.items())
+            rows.extend(('cache_misses', k, v)
+                        for (k, v) in self.cache_misses.items())
+            rows.extend(('token_remaining', k, v)
+                        for (k, v) in self.token_remaining.items())
+        return rows
+
+    def set_snapshots(self, rows):
+        """Set the counters from the snapshots of all the workers.
+
+        The counts are summed up, the tokens are shared by the workers,
+        so the lowest remaining quota of each one is kept.
+        """
+        clone_bytes = 0
+        cache_hits = defaultdict(int)
+        cache_misses = defaultdict(int)
+        token_remaining = {}
+        for (name, label, value) in rows:
+            value = int(value)
+            if name == 'clone_bytes':
+                clone_bytes += value
+            elif name == 'cache_hits':
+                cache_hits[label] += value
+            elif name == 'cache_misses':
+                cache_misses[label] += value
+            elif name == 'token_remaining':
+                token_remaining[label] = min(
+                    value, token_remaining.get(label, value))
+        with self.lock:
+            self.clone_bytes = clone_bytes
+            self.cache_hits = cache_hits
+            self.cache_misses = cache_misses
+            self.token_remaining = token_remaining
+
+    def _rates(self):
+        elapsed = time.time() - self.start_time
+        per_minute = (self.done + self.failed) * 60 / elapsed
+        eta = None
+        if per_minute:
+            eta = (self.queued + self.in_flight) * 60 / per_minute
+        hits = sum(self.cache_hits.values())
+        total = hits + sum(self.cache_misses.values())
+        hit_rate = hits / total if total else 0
+        return elapsed, per_minute, eta, hit_rate
+
+    def render(self):
+        """Return the metrics in Prometheus text format."""
+        if self.collector:
+            self.collector(self)
+        with self.lock:
+            elapsed, per_minute, eta, _ = self._rates()
+            metrics = [
+                ('repos_done_total', 'counter', 'Repos scored.',
+                 [('', self.done)]),
+                ('repos_failed_total', 'counter', 'Repos failed.',
+                 [('', self.failed)]),
+                ('repos_in_flight', 'gauge', 'Repos being scored.',
+                 [('', self.in_flight)]),
+                ('repos_queued', 'gauge', 'Repos waiting to be scored.',
+                 [('', self.queued)]),
+                ('repos_per_minute', 'gauge', 'Repos finished per minute.',
+                 [('', round(per_minute, 3))]),
+                ('eta_seconds', 'gauge', 'Estimated time to completion.',
+                 [('', round(eta, 1))] if eta is not None else []),
+                ('github_token_remaining', 'gauge',
+                 'Remaining API quota of each GitHub token.',
+                 [('{token="%s"}' % k, v)
+                  for (k, v) in sorted(self.token_remaining.items())]),
+                ('cache_hits_total', 'counter', 'Cache hits.',
+                 [('{cache="%s"}' % k, v)
+                  for (k, v) in sorted(self.cache_hits.items())]),
+                ('cache_misses_total', 'counter', 'Cache misses.',
+                 [('{cache="%s"}' % k, v)
+                  for (k, v) in sorted(self.cache_misses.items())]),
+                ('clone_bytes_total', 'counter', 'Bytes received by clones.',
+                 [('', self.clone_bytes)]),
+                ('uptime_seconds', 'gauge', 'Time since the run started.',
+                 [('', round(elapsed, 1))]),
+            ]
+
+        lines = []
+        for (name, metric_type, doc, samples) in metrics:
+            lines.append('# HELP reposcore_%s %s' % (name, doc))
+            lines.append('# TYPE reposcore_%s %s' % (name, metric_type))
+            for (labels, value) in samples:
+                lines.append('reposcore_%s%s %s' % (name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Return a one line summary of the run."""
+        if self.collector:
+            self.collector(self)
+        with self.lock:
+            _, per_minute, eta, hit_rate = self._rates()
+            quota = ' '.join('%s:%s' % (k, v) for (k, v) in sorted(
+                self.token_remaining.items()))
+            return (
+                'done %d, failed %d, in flight %d, queued %d, '
+                '%.1f repos/min, eta %s, cache hit %.0f%%, '
+                'cloned %.1f MiB, token quota [%s]' % (
+                    self.done, self.failed, self.in_flight, self.queued,
+                    per_minute,
+                    '%.1f min' % (eta / 60) if eta is not None else '-',
+                    hit_rate * 100, self.clone_bytes / (1 << 20), quota))
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve /metrics on host:port in a daemon thread.
+
+        Return the server, or None if it can not be started, the run
+        goes on without the endpoint then.
+        """
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # Keep the scrapes out of the output
+                pass
+
+        class _Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        try:
+            server = _Server((host, port), _Handler)
+        except OSError as exp:
+            print('Failed serving metrics on %s:%d, run without them. '
+                  'Detail: %s' % (host, port, exp), file=sys.stderr)
+            return None
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print('Serving metrics on http://%s:%d/metrics' % (host, port),
+              file=sys.stderr)
+        return server
+
+    def report(self, interval):
+        """Print the summary every interval seconds in a daemon thread."""
+        def _report():
+            while True:
+                time.sleep(interval)
+                print('[reposcore] %s' % self.summary(), file=sys.stderr)
+
+        thread = threading.Thread(target=_report, daemon=True)
+        thread.start()
+        return thread
+
+
+# The metrics of this process
+METRICS = Metrics()
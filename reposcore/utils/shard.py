@@ -0,0 +1,144 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shard routing and the shared result journal of distributed runs."""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+
+def parse_shard(value):
+    """Parse a 'i/N' shard spec into (i, N), i is in [0, N)."""
+    try:
+        index, count = [int(i) for i in value.split('/')]
+    except ValueError:
+        raise Exception("Invalid shard %s, should be like 0/4" % value)
+    if count < 1 or not 0 <= index < count:
+        raise Exception("Invalid shard %s, should be like 0/4" % value)
+    return index, count
+
+
+def shard_of(url, count):
+    """Return the shard of a url.
+
+    The hash is stable across processes and nodes, so the same repo is
+    always routed to the same node and its local clone stays warm.
+    """
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return int(digest, 16) % count
+
+
+class Journal():
+    """SQLite journal of the results of one shard.
+
+    Every scored repo is recorded with its status, and the result rows
+    of all its input urls. Repos which are done are skipped when a run
+    is resumed, and the merge step reads the rows of all the shards back.
+
+    A journal is written by a single worker and should be on a local
+    disk, SQLite locking is not reliable on network filesystems. Copy
+    the journals of all the nodes together to merge them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS journal ('
+                'url TEXT PRIMARY KEY, shard TEXT, status TEXT, '
+                'detail TEXT, updated_at REAL)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'input_url TEXT PRIMARY KEY, url TEXT, row TEXT)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS metrics ('
+                'name TEXT, label TEXT, value REAL, '
+                'PRIMARY KEY (name, label))')
+
+    def is_done(self, url):
+        cur = self.conn.execute(
+            'SELECT status FROM journal WHERE url = ?', (url,))
+        status = cur.fetchone()
+        return bool(status) and status[0] == 'done'
+
+    def _mark(self, url, shard, status, detail=''):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?)',
+            (url, shard, status, detail, time.time()))
+
+    def add_result(self, url, rows, shard=''):
+        """Record the result rows of a repo, one per input url."""
+        with self.conn:
+            for row in rows:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                    (row['input_url'], url, json.dumps(row)))
+            self._mark(url, shard, 'done')
+
+    def add_missing_aliases(self, url, aliases):
+        """Record rows for the input urls of a done repo which have none.
+
+        The rows are copied from a row already stored for the repo, and
+        returned.
+        """
+        cur = self.conn.execute(
+            'SELECT input_url, row FROM results WHERE url = ?', (url,))
+        stored = dict(cur.fetchall())
+        missing = [alias for alias in aliases if alias not in stored]
+        if not stored or not missing:
+            return []
+        row = json.loads(next(iter(stored.values())))
+        rows = [dict(row, input_url=alias) for alias in missing]
+        with self.conn:
+            for row in rows:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                    (row['input_url'], url, json.dumps(row)))
+        return rows
+
+    def add_failure(self, url, detail, shard=''):
+        with self.conn:
+            self._mark(url, shard, 'failed', detail)
+
+    def counts(self, since):
+        """Return the count of repos done and failed since a time, and
+        the count of repos done before it.
+        """
+        cur = self.conn.execute(
+            "SELECT "
+            "SUM(status = 'done' AND updated_at >= ?), "
+            "SUM(status = 'failed' AND updated_at >= ?), "
+            "SUM(status = 'done' AND updated_at < ?) FROM journal",
+            (since, since, since))
+        return tuple(count or 0 for count in cur.fetchone())
+
+    def save_metrics(self, rows):
+        """Replace the metrics snapshot of the worker of this shard."""
+        with self.conn:
+            self.conn.execute('DELETE FROM metrics')
+            self.conn.executemany(
+                'INSERT INTO metrics VALUES (?, ?, ?)', rows)
+
+    def load_metrics(self):
+        return self.conn.execute(
+            'SELECT name, label, value FROM metrics').fetchall()
+
+    def rows(self):
+        """Yield all the result rows, in insertion order."""
+        cur = self.conn.execute('SELECT row FROM results ORDER BY rowid')
+        for (row,) in cur:
+            yield json.loads(row)
+
+    def close(self):
+        self.conn.close()
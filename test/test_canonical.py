@@ -0,0 +1,67 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from reposcore.repo.canonical import canonicalize_url
+
+
+class CanonicalizeUrlTest(unittest.TestCase):
+
+    def test_github_aliases(self):
+        for url in ['github.com/X/Y',
+                    'https://github.com/x/y/',
+                    'http://www.github.com/X/Y',
+                    'https://github.com:443/x/y',
+                    'https://github.com/x/y.git',
+                    'https://github.com/x/y/tree/master',
+                    'git@github.com:x/y.git',
+                    'ssh://git@github.com/x/y.git',
+                    '  https://github.com/x/y  ']:
+            self.assertEqual(
+                'https://github.com/x/y', canonicalize_url(url), url)
+
+    def test_empty(self):
+        self.assertIsNone(canonicalize_url(''))
+        self.assertIsNone(canonicalize_url('   '))
+
+    def test_gitlab_keeps_scheme_and_port(self):
+        self.assertEqual(
+            'https://gitlab.example.com:8443/g/p',
+            canonicalize_url('https://gitlab.example.com:8443/g/p'))
+        self.assertEqual(
+            'http://gitlab.internal/g/p',
+            canonicalize_url('http://gitlab.internal/g/p'))
+
+    def test_gitlab_drops_default_port_and_userinfo(self):
+        self.assertEqual(
+            'https://gitlab.com/g/p',
+            canonicalize_url('https://gitlab.com:443/g/p.git'))
+        self.assertEqual(
+            'http://gitlab.internal/g/p',
+            canonicalize_url('http://user:pw@gitlab.internal:80/g/p'))
+
+    def test_gitlab_ssh_uses_https(self):
+        self.assertEqual(
+            'https://gitlab.x.org/g/p',
+            canonicalize_url('git@gitlab.x.org:g/p.git'))
+        self.assertEqual(
+            'https://gitlab.x.org/g/p',
+            canonicalize_url('ssh://git@gitlab.x.org:2222/g/p'))
+
+    def test_gitlab_nested_groups(self):
+        self.assertEqual(
+            'https://gitlab.com/a/b/c',
+            canonicalize_url('https://gitlab.com/a/b/c/-/tree/main'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import configparser
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from git import Repo
+
+from reposcore.repo import repo as rs_repo
+from reposcore.utils import git_utils
+
+
+class FakeRepo(object):
+    full_name = 'owner/project'
+    language = 'C'
+
+
+class IterCommitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.path = os.path.join(self.base, FakeRepo.full_name)
+        os.makedirs(self.path)
+        self._git('init', '-q')
+        self._git('checkout', '-q', '-b', 'main')
+
+        # root commit, a single line file and a file name with a space
+        self._write('x.c', 'a\nb\n')
+        self._write('sp ace.h', 'q\n')
+        self._commit('one', 'Alice', 'alice@example.com')
+        # rename with a single insertion
+        self._git('mv', 'x.c', 'y.c')
+        self._write('y.c', 'a\nb\nc\n')
+        self._commit('two', 'alice', 'ALICE@example.com')
+        # a branch merged back
+        self._git('checkout', '-q', '-b', 'topic')
+        self._write('z.py', 'z\n')
+        self._commit('three', 'Bob', 'bob@old.example.com')
+        self._git('checkout', '-q', 'main')
+        self._write('w.c', 'w\n')
+        self._git('rm', '-q', 'sp ace.h')
+        self._commit('four', 'Carol', 'carol@example.com')
+        self._git('merge', '-q', '--no-edit', 'topic',
+                  env=self._author_env('Carol', 'carol@example.com'))
+        # binary file
+        self._write('bin.c', '\x00\x01\x02')
+        self._commit('five', 'Carol', 'carol@example.com')
+        # mapped author with a non ascii name
+        self._write('.mailmap',
+                    'Böb <bob@new.example.com> <bob@old.example.com>\n')
+        self._commit('six', 'Bob', 'bob@old.example.com')
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def _author_env(self, name, email):
+        env = dict(os.environ, LC_ALL='C')
+        env.update({
+            'GIT_AUTHOR_NAME': name, 'GIT_AUTHOR_EMAIL': email,
+            'GIT_COMMITTER_NAME': name, 'GIT_COMMITTER_EMAIL': email,
+        })
+        return env
+
+    def _git(self, *args, env=None):
+        return subprocess.run(
+            ('git',) + args, cwd=self.path, env=env or self._author_env(
+                'Test', 'test@example.com'),
+            check=True, stdout=subprocess.PIPE).stdout.decode('utf-8')
+
+    def _write(self, name, content):
+        with open(os.path.join(self.path, name), 'w') as file_handle:
+            file_handle.write(content)
+
+    def _commit(self, message, name, email):
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', message,
+                  env=self._author_env(name, email))
+
+    def _shortstat(self, *pathspec):
+        out = self._git('log', '--shortstat', '--format=', '--', *pathspec)
+        addition = sum(int(i) for i in re.findall(r'(\d+) insertion', out))
+        deletion = sum(int(i) for i in re.findall(r'(\d+) deletion', out))
+        return addition, deletion
+
+    def test_iter_commits(self):
+        commits = list(git_utils.iter_commits(Repo(self.path)))
+        self.assertEqual(7, len(commits))
+        by_message = dict(zip(
+            ['six', 'five', 'merge', 'four', 'three', 'two', 'one'],
+            commits))
+
+        self.assertEqual((), by_message['one'].parents)
+        self.assertEqual(2, len(by_message['merge'].parents))
+        self.assertEqual((), by_message['merge'].files)
+        self.assertEqual(
+            {('x.c', 2, 0), ('sp ace.h', 1, 0)},
+            set(by_message['one'].files))
+        self.assertEqual((('y.c', 1, 0),), by_message['two'].files)
+        self.assertEqual((('bin.c', None, None),), by_message['five'].files)
+        self.assertEqual(
+            {('w.c', 1, 0), ('sp ace.h', 0, 1)},
+            set(by_message['four'].files))
+
+        self.assertEqual('Böb', by_message['six'].author_name)
+        self.assertEqual('bob@new.example.com', by_message['six'].author_email)
+        self.assertEqual('Böb', by_message['three'].author_name)
+
+    def test_log_summary_matches_shortstat(self):
+        config = configparser.ConfigParser()
+        config.read_dict({'global': {'repos_location': self.base}})
+        local_repo = rs_repo.GitLocalRepo(FakeRepo(), config)
+
+        self.assertEqual(
+            self._shortstat(), local_repo._code_line_change_recent_year())
+        for ext in ('c', 'h'):
+            self.assertEqual(
+                self._shortstat('*.' + ext),
+                local_repo._code_line_change_recent_year('*.' + ext))
+
+        summary = local_repo._log_summary(
+            local_repo.local_path, local_repo._matches())
+        # merged by email: alice, bob, carol
+        self.assertEqual(
+            {'alice@example.com': 2, 'bob@new.example.com': 2,
+             'carol@example.com': 3},
+            dict(summary['authors']))
+        self.assertEqual(6, summary['commits'])
+
+
+if __name__ == '__main__':
+    unittest.main()